@@ -1,18 +1,19 @@
 import datetime
 import argparse
-import openai
 import os
 from email.message import EmailMessage
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func
 from database import SessionLocal
-from models import PositivePoint, NegativePoint, Organization, Response, Employee
+from models import PositivePoint, NegativePoint, Organization, Response
+from llm_gateway import chat_completion, BudgetExceeded
+from llm_parsing import parse_aspects_response
+from report_rendering import build_report_context, render_report_html, render_report_text
 import yaml
 import pandas as pd
 import smtplib
 import logging
 import re
-import json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,9 +23,8 @@ def load_config(config_path='config.yaml'):
         return yaml.safe_load(f)
         
 config = load_config()
-openai.api_key = config['openai']['api_key']
 
-def send_to_gpt4(positive_text, negative_text, activity):
+def send_to_gpt4(org_id, positive_text, negative_text, activity):
     prompt = f"""
 Привет!
 
@@ -49,38 +49,26 @@ def send_to_gpt4(positive_text, negative_text, activity):
 Спасибо!
 """
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
+        response = chat_completion(
+            org_id,
             messages=[
                 {"role": "system", "content": "Ты помощник, который формирует ответ в формате JSON."},
                 {"role": "user", "content": prompt}
             ],
+            purpose="report",
             max_tokens=1500,
             temperature=0.3,
+            json_output=True,
         )
-        return response['choices'][0]['message']['content'].strip()
+        return response.strip()
+    except BudgetExceeded as e:
+        # отчет все равно отправляем, но без сводки GPT-4
+        logger.warning(f'Сводка GPT-4 пропущена: {e}')
+        return ''
     except Exception as e:
         print(f'Ошибка при обращении к GPT-4 API: {e}')
         return None
 
-def parse_gpt4_response(response_text):
-    try:
-        response_json = json.loads(response_text)
-        
-        top_positive_data = response_json.get('positive', [])
-        top_negative_data = response_json.get('negative', [])
-        main_aspects_data = response_json.get('main', [])
-        
-        top_positive_data = sorted(top_positive_data, key=lambda x: x.get('count', 0), reverse=True)
-        top_negative_data = sorted(top_negative_data, key=lambda x: x.get('count', 0), reverse=True)
-        main_aspects_data = sorted(main_aspects_data, key=lambda x: x.get('count', 0), reverse=True)
-        
-        return top_positive_data, top_negative_data, main_aspects_data
-    
-    except json.JSONDecodeError as e:
-        logger.error(f'Ошибка при разборе JSON ответа от GPT-4: {e}')
-        return [], [], []
-
 def send_email(org, excel_file_path, brief_excel_file_path, top_positive_data, top_negative_data, main_aspects_data):
     smtp_config = config['smtp']
     msg = EmailMessage()
@@ -88,51 +76,9 @@ def send_email(org, excel_file_path, brief_excel_file_path, top_positive_data, t
     msg['From'] = smtp_config['from_email']
     msg['To'] = ', '.join([email.email_address for email in org.emails])
     
-    # Создание HTML тела письма
-    email_body = f"""
-    <html>
-    <body>
-        <p>Здравствуйте,</p>
-        <p>Во вложении вы найдёте еженедельный отчёт для организации <b>{org.name}</b>.</p>
-    """
-    
-    if top_positive_data:
-        email_body += "<h3>Основные позитивные аспекты:</h3>"
-        email_body += "<table border='1' style='border-collapse: collapse; width: 100%;'>"
-        email_body += "<tr><th>Аспект</th><th>Количество</th><th>Комментарий</th></tr>"
-        for item in top_positive_data:
-            email_body += f"<tr><td>{item['aspect']}</td><td>{item['count']}</td><td>{item['comment']}</td></tr>"
-        email_body += "</table><br>"
-    else:
-        email_body += "<p>Нет данных по позитивным аспектам.</p>"
-        
-    if top_negative_data:
-        email_body += "<h3>Основные негативные аспекты:</h3>"
-        email_body += "<table border='1' style='border-collapse: collapse; width: 100%;'>"
-        email_body += "<tr><th>Аспект</th><th>Количество</th><th>Комментарий</th></tr>"
-        for item in top_negative_data:
-            email_body += f"<tr><td>{item['aspect']}</td><td>{item['count']}</td><td>{item['comment']}</td></tr>"
-        email_body += "</table><br>"
-    else:
-        email_body += "<p>Нет данных по негативным аспектам.</p>"
-        
-    if main_aspects_data:
-        email_body += "<h3>Главные аспекты деятельности компании:</h3>"
-        email_body += "<table border='1' style='border-collapse: collapse; width: 100%;'>"
-        email_body += "<tr><th>Аспект</th><th>Количество</th><th>Комментарий</th></tr>"
-        for item in main_aspects_data:
-            email_body += f"<tr><td>{item['aspect']}</td><td>{item['count']}</td><td>{item['comment']}</td></tr>"
-        email_body += "</table><br>"
-    else:
-        email_body += "<p>Нет данных по главным аспектам.</p>"
-    
-    email_body += """
-        <p>С уважением,<br>Ваш бот.</p>
-    </body>
-    </html>
-    """
-    msg.set_content("Ваш почтовый клиент не поддерживает HTML.")
-    msg.add_alternative(email_body, subtype='html')
+    report_context = build_report_context(org.name, top_positive_data, top_negative_data, main_aspects_data)
+    msg.set_content(render_report_text(report_context))
+    msg.add_alternative(render_report_html(report_context), subtype='html')
 
     try:
         with open(excel_file_path, 'rb') as f:
@@ -170,11 +116,11 @@ def generate_excel_report(org_id, start_date, end_date, top_positive_counts, top
     try:
         responses = (
             session.query(Response)
-            .join(Response.employee)
+            .options(joinedload(Response.employee))
             .filter(
+                Response.organization_id == org_id,
                 Response.timestamp >= start_date,
-                Response.timestamp <= end_date,
-                Employee.organization_id == org_id
+                Response.timestamp <= end_date
             )
             .all()
         )
@@ -258,33 +204,29 @@ def analyze_points(org_id, days=7):
         positive_counts = (
             session.query(
                 PositivePoint.point_text,
-                func.count(PositivePoint.id).label('count')
+                func.count().label('count')
             )
-            .join(PositivePoint.response)
-            .join(Response.employee)
             .filter(
-                Response.timestamp >= start_date,
-                Response.timestamp <= end_date,
-                Employee.organization_id == org_id
+                PositivePoint.organization_id == org_id,
+                PositivePoint.timestamp >= start_date,
+                PositivePoint.timestamp <= end_date
             )
             .group_by(PositivePoint.point_text)
-            .order_by(func.count(PositivePoint.id).desc())
+            .order_by(func.count().desc())
             .all()
         )
         negative_counts = (
             session.query(
                 NegativePoint.point_text,
-                func.count(NegativePoint.id).label('count')
+                func.count().label('count')
             )
-            .join(NegativePoint.response)
-            .join(Response.employee)
             .filter(
-                Response.timestamp >= start_date,
-                Response.timestamp <= end_date,
-                Employee.organization_id == org_id
+                NegativePoint.organization_id == org_id,
+                NegativePoint.timestamp >= start_date,
+                NegativePoint.timestamp <= end_date
             )
             .group_by(NegativePoint.point_text)
-            .order_by(func.count(NegativePoint.id).desc())
+            .order_by(func.count().desc())
             .all()
         )
         if not positive_counts and not negative_counts:
@@ -299,12 +241,14 @@ def analyze_points(org_id, days=7):
         logger.info("Отправка данных в GPT-4 для формирования отчета...")
         top_positive_counts = positive_counts[:5]
         top_negative_counts = negative_counts[:5]
-        gpt_response = send_to_gpt4(positive_text, negative_text, activity)
-        if gpt_response:
-            top_positive_data, top_negative_data, main_aspects_data = parse_gpt4_response(gpt_response)
-        else:
+        gpt_response = send_to_gpt4(org_id, positive_text, negative_text, activity)
+        if gpt_response is None:
             logger.error('Не удалось получить ответ от GPT-4.')
             return
+        if gpt_response:
+            top_positive_data, top_negative_data, main_aspects_data = parse_aspects_response(gpt_response)
+        else:
+            top_positive_data, top_negative_data, main_aspects_data = [], [], []
         excel_file_path = generate_excel_report(org_id, start_date, end_date, top_positive_counts, top_negative_counts)
         if not excel_file_path:
             logger.error('Не удалось сформировать Excel-отчет.')
@@ -0,0 +1,36 @@
+from collections import OrderedDict, namedtuple
+import yaml
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+config = load_config()
+
+EmployeeIdentity = namedtuple('EmployeeIdentity', ['employee_id', 'organization_id', 'name'])
+
+class EmployeeCache:
+    # LRU-кэш telegram_id -> EmployeeIdentity, ограниченный maxsize записями;
+    # сотрудники создаются и переносятся только в start_command_handler, там же обновляется кэш
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, telegram_id):
+        identity = self.entries.get(telegram_id)
+        if identity is not None:
+            self.entries.move_to_end(telegram_id)
+        return identity
+
+    def put(self, telegram_id, identity):
+        self.entries[telegram_id] = identity
+        self.entries.move_to_end(telegram_id)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def put_employee(self, employee):
+        identity = EmployeeIdentity(employee.id, employee.organization_id, employee.name)
+        self.put(employee.telegram_id, identity)
+        return identity
+
+employee_cache = EmployeeCache(maxsize=config.get('cache', {}).get('employee_cache_size', 10000))
@@ -1,10 +1,12 @@
 import logging
-import openai
 from aiogram import Router, F, Dispatcher
 from aiogram.filters.command import Command
 from aiogram.types import Message
 from database import SessionLocal
 from models import Employee, BotMessage, Response, PositivePoint, NegativePoint, OrganizationMessage
+from employee_cache import employee_cache
+from llm_gateway import achat_completion, BudgetExceeded
+from llm_parsing import parse_points_response
 import datetime
 import logging
 
@@ -26,8 +28,10 @@ async def start_command_handler(message: Message, org_id: int):
         if employee.organization_id != org_id:
             employee.organization_id = org_id
             session.commit()
+            employee_cache.put_employee(employee)
             await message.answer("Ваш аккаунт был перенесен в текущую организацию.")
         else:
+            employee_cache.put_employee(employee)
             await message.answer("Вы уже зарегистрированы в этой организации.")  
         session.close()
     else:
@@ -39,6 +43,7 @@ async def start_command_handler(message: Message, org_id: int):
         session.add(employee)
         session.commit()
         session.refresh(employee)
+        employee_cache.put_employee(employee)
         
     await message.answer(f"Привет, хочу узнать чем живет моя команда. ")
     session.query(BotMessage).filter(BotMessage.employee_id == employee.id).delete()
@@ -59,7 +64,11 @@ async def start_command_handler(message: Message, org_id: int):
 async def message_handler(message: Message, org_id: int):
     session = SessionLocal()
     telegram_id = str(message.from_user.id)
-    employee = session.query(Employee).filter(Employee.telegram_id == telegram_id).first()
+    employee = employee_cache.get(telegram_id)
+    if employee is None:
+        db_employee = session.query(Employee).filter(Employee.telegram_id == telegram_id).first()
+        if db_employee:
+            employee = employee_cache.put_employee(db_employee)
 
     if not employee:
         await message.answer("Вы не зарегистрированы. Введите /start для регистрации.")
@@ -74,7 +83,7 @@ async def message_handler(message: Message, org_id: int):
     org_messages = session.query(OrganizationMessage).filter(OrganizationMessage.organization_id == org_id).order_by(OrganizationMessage.order).all()
     questions = [m.message_text for m in org_messages]
 
-    last_bot_message = session.query(BotMessage).filter(BotMessage.employee_id==employee.id).order_by(BotMessage.timestamp.desc()).first()
+    last_bot_message = session.query(BotMessage).filter(BotMessage.employee_id==employee.employee_id).order_by(BotMessage.timestamp.desc()).first()
 
     if not questions:
         await message.answer("Простите, но сейчас у меня нет вопросов для вас!")
@@ -97,8 +106,10 @@ async def message_handler(message: Message, org_id: int):
 
     
     response = Response(
-        employee_id=employee.id,
+        employee_id=employee.employee_id,
+        organization_id=org_id,
         response_text=message.text,
+        extraction_pending=True,
         question=last_bot_message.message_text if last_bot_message else (questions[0] if questions else "")
     )
     session.add(response)
@@ -109,85 +120,73 @@ async def message_handler(message: Message, org_id: int):
         if next_index < len(questions):
             next_q = questions[next_index]
             await message.answer(next_q)
-            new_msg = BotMessage(employee_id=employee.id, message_text=next_q)
+            new_msg = BotMessage(employee_id=employee.employee_id, message_text=next_q)
             session.add(new_msg)
         else:
             final_msg = "Пока вопросы закончились! Спасибо за участие в опросе!"
             await message.answer(final_msg)
-            new_msg = BotMessage(employee_id=employee.id, message_text=final_msg)
+            new_msg = BotMessage(employee_id=employee.employee_id, message_text=final_msg)
             session.add(new_msg)
         session.commit()
     else:
         if next_question and next_question != response.question:
             await message.answer(next_question)
-            new_msg = BotMessage(employee_id=employee.id, message_text=next_question)
+            new_msg = BotMessage(employee_id=employee.employee_id, message_text=next_question)
             session.add(new_msg)
             session.commit()
         else:
             final_msg = "Пока вопросы закончились! Спасибо за участие!"
             await message.answer(final_msg)
-            new_msg = BotMessage(employee_id=employee.id, message_text=final_msg)
+            new_msg = BotMessage(employee_id=employee.employee_id, message_text=final_msg)
             session.add(new_msg)
             session.commit()
     
-    prompt = (
-        "Раздели следующий текст на положительные и отрицательные моменты. "
-        "Представь их в виде списка с плюсами и минусами:\n\n"
-        f"Вопрос: {response.question}\n"
-        f"Ответ: {response.response_text}"
-    )
     try:
-        completion = await openai.ChatCompletion.acreate(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": """
-                        Ты — аналитический помощник, специализирующийся на анализе отзывов сотрудников о работе в компании. Твоя задача — выделить и стандартизировать плюсы и минусы из предоставленного отзыва. Пожалуйста, ответь в следующем формате: 
-                        Плюсы: 
-                        1. 
-                        2.
-                        Минусы: 
-                        1. 
-                        2. 
-                        Учти следующее: - В разделе "Плюсы" перечисли только положительные аспекты работы в компании. - В разделе "Минусы" укажи только негативные аспекты, которые можно улучшить. - Стандартизируй формулировки, чтобы схожие моменты описывались одинаково (например, "гибкий график работы" и "флексибельные часы" должны быть представлены одинаково). - Используй краткие и четкие фразы для каждого пункта. - Придерживайся нумерованного списка для удобства последующего анализа. - Избегай личных оценок и субъективных суждений.
-                    """},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            max_tokens=500
-        )
-        gpt_response = completion.choices[0].message['content']
-        pos_points, neg_points = parse_gpt_response(gpt_response)
-        for p in pos_points:
-            pp = PositivePoint(response_id=response.id, point_text=p)
-            session.add(pp)
-        for n in neg_points:
-            np = NegativePoint(response_id=response.id, point_text=n)
-            session.add(np)
-        session.commit()
+        await extract_points(session, response)
+    except BudgetExceeded as e:
+        logger.warning(f"Извлечение поинтов для ответа {response.id} отложено: {e}")
     except Exception as e:
         logger.error(f"Ошибка OpenAI: {e}")
+        record_extraction_failure(session, response)
 
     session.close()
 
-def parse_gpt_response(gpt_response):
-    positive_points = []
-    negative_points = []
-    try:
-        sections = gpt_response.split("Минусы:")
-        positives = sections[0].replace("Плюсы:", "").strip()
-        negatives = sections[1].strip() if len(sections) > 1 else ""
-
-        for line in positives.split('\n'):
-            if line.strip().startswith(('1.', '2.', '3.', '-', '*')):
-                point = line.strip().lstrip('-—–*0123456789. ').strip()
-                if point:
-                    positive_points.append(point)
-
-        for line in negatives.split('\n'):
-            if line.strip().startswith(('1.', '2.', '3.', '-', '*')):
-                point = line.strip().lstrip('-—–*0123456789. ').strip()
-                if point:
-                    negative_points.append(point)
-    except Exception as e:
-        logger.error(f"Ошибка парсинга GPT: {e}")
-    return positive_points, negative_points
+async def extract_points(session, response):
+    prompt = (
+        "Раздели следующий текст на положительные и отрицательные моменты:\n\n"
+        f"Вопрос: {response.question}\n"
+        f"Ответ: {response.response_text}"
+    )
+    gpt_response = await achat_completion(
+        response.organization_id,
+        messages=[
+            {"role": "system", "content": """
+                        Ты — аналитический помощник, специализирующийся на анализе отзывов сотрудников о работе в компании. Твоя задача — выделить и стандартизировать плюсы и минусы из предоставленного отзыва. Ответь только JSON-объектом следующего вида, без пояснений и форматирования:
+                        {"positive": ["плюс 1", "плюс 2"], "negative": ["минус 1", "минус 2"]}
+                        Учти следующее: - В списке "positive" перечисли только положительные аспекты работы в компании. - В списке "negative" укажи только негативные аспекты, которые можно улучшить. - Если аспектов нет, оставь список пустым. - Стандартизируй формулировки, чтобы схожие моменты описывались одинаково (например, "гибкий график работы" и "флексибельные часы" должны быть представлены одинаково). - Используй краткие и четкие фразы для каждого пункта. - Избегай личных оценок и субъективных суждений.
+                    """},
+            {"role": "user", "content": prompt}
+        ],
+        purpose="extraction",
+        temperature=0.5,
+        max_tokens=500,
+        text_length=len(response.response_text or ""),
+        json_output=True
+    )
+    pos_points, neg_points = parse_points_response(gpt_response)
+    # время поинта совпадает со временем ответа, чтобы отложенное извлечение не сдвигало его в другой отчетный период
+    for p in pos_points:
+        pp = PositivePoint(response_id=response.id, organization_id=response.organization_id, point_text=p, timestamp=response.timestamp)
+        session.add(pp)
+    for n in neg_points:
+        np = NegativePoint(response_id=response.id, organization_id=response.organization_id, point_text=n, timestamp=response.timestamp)
+        session.add(np)
+    response.extraction_pending = False
+    session.commit()
+
+def record_extraction_failure(session, response):
+    # неудачные попытки считаем, чтобы отложенное извлечение не повторяло безнадежные ответы бесконечно
+    session.rollback()
+    response.extraction_attempts = (response.extraction_attempts or 0) + 1
+    response.extraction_attempted_at = datetime.datetime.utcnow()
+    session.commit()
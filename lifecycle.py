@@ -0,0 +1,62 @@
+import asyncio
+import contextlib
+import logging
+import signal
+import sys
+
+logger = logging.getLogger(__name__)
+
+class LifecycleManager:
+    # отслеживает выполняющиеся задачи бота и останавливает процесс без потери работы
+    def __init__(self):
+        self.stop_event = None
+        self.tasks = set()
+
+    @property
+    def stopping(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def get_stop_event(self):
+        if self.stop_event is None:
+            self.stop_event = asyncio.Event()
+        return self.stop_event
+
+    def request_stop(self):
+        if not self.stopping:
+            logger.info('Получен сигнал остановки, новые обновления больше не принимаются.')
+        self.get_stop_event().set()
+
+    def install_signal_handlers(self, loop):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            if sys.platform.startswith('win'):
+                signal.signal(sig, lambda *args: loop.call_soon_threadsafe(self.request_stop))
+            else:
+                loop.add_signal_handler(sig, self.request_stop)
+
+    async def wait_for_stop(self):
+        await self.get_stop_event().wait()
+
+    @contextlib.asynccontextmanager
+    async def in_flight(self):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            yield
+        finally:
+            self.tasks.discard(task)
+
+    async def drain(self, timeout):
+        current = asyncio.current_task()
+        pending = {task for task in self.tasks if task is not current and not task.done()}
+        if not pending:
+            return
+        logger.info(f'Ожидание завершения {len(pending)} задач (не более {timeout} с).')
+        done, pending = await asyncio.wait(pending, timeout=timeout)
+        if pending:
+            # незавершенная работа уже сохранена в БД и будет продолжена при следующем запуске
+            logger.warning(f'Прерывание {len(pending)} задач, не завершившихся за {timeout} с.')
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+lifecycle = LifecycleManager()
@@ -0,0 +1,235 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import threading
+import openai
+import yaml
+from sqlalchemy import func
+from database import SessionLocal
+from models import Organization, LLMUsage
+
+logger = logging.getLogger(__name__)
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+config = load_config()
+openai.api_key = config['openai']['api_key']
+
+DEFAULT_LLM_SETTINGS = {
+    'model': 'gpt-4',
+    'short_model': 'gpt-3.5-turbo',
+    'short_answer_chars': 300,
+    'json_mode': False,
+    'max_concurrency': 4,
+    'global_daily_token_budget': None,
+    'global_daily_request_budget': None,
+    'daily_token_budget': None,
+    'daily_request_budget': None,
+}
+
+class BudgetExceeded(Exception):
+    pass
+
+org_names = {}
+
+def get_org_name(org_id):
+    if org_id not in org_names:
+        session = SessionLocal()
+        try:
+            organization = session.query(Organization).filter(Organization.id == org_id).first()
+            org_names[org_id] = organization.name if organization else None
+        finally:
+            session.close()
+    return org_names[org_id]
+
+def get_llm_settings(org_id=None):
+    # глобальные настройки из секции llm, переопределяются в секции llm организации
+    settings = dict(DEFAULT_LLM_SETTINGS)
+    settings.update(config.get('llm') or {})
+    if org_id is not None:
+        org_name = get_org_name(org_id)
+        for org_data in config.get('organizations', []):
+            if org_data.get('name') == org_name:
+                settings.update(org_data.get('llm') or {})
+    return settings
+
+def select_model(settings, text_length=None):
+    # короткие ответы отправляем в более дешевую и быструю модель
+    if text_length is not None and text_length <= settings['short_answer_chars']:
+        return settings['short_model']
+    return settings['model']
+
+def estimate_tokens(messages, max_tokens):
+    # грубая оценка до вызова: ~3 символа на токен для русского текста плюс максимум ответа
+    prompt_chars = sum(len(message['content']) for message in messages)
+    return prompt_chars // 3 + max_tokens
+
+def budget_keys(org_id):
+    return (None,) if org_id is None else (None, org_id)
+
+class UsageBudget:
+    # дневные счетчики токенов и запросов: глобальный (ключ None) и по организациям
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day = None
+        self.usage = {}
+
+    def load_today(self, day):
+        day_start = datetime.datetime.combine(day, datetime.time.min)
+        session = SessionLocal()
+        try:
+            rows = (
+                session.query(
+                    LLMUsage.organization_id,
+                    func.sum(LLMUsage.total_tokens),
+                    func.count()
+                )
+                .filter(LLMUsage.timestamp >= day_start)
+                .group_by(LLMUsage.organization_id)
+                .all()
+            )
+        finally:
+            session.close()
+        usage = {None: [0, 0]}
+        for org_id, tokens, requests in rows:
+            usage[org_id] = [tokens or 0, requests]
+            usage[None][0] += tokens or 0
+            usage[None][1] += requests
+        return usage
+
+    def needs_roll(self):
+        return self.day != datetime.datetime.utcnow().date()
+
+    def roll_day(self):
+        # запрос к БД выполняется без блокировки; из асинхронного кода вызывается в отдельном потоке
+        today = datetime.datetime.utcnow().date()
+        if self.day == today:
+            return
+        usage = self.load_today(today)
+        with self.lock:
+            if self.day != today:
+                self.day = today
+                self.usage = usage
+
+    def check(self, key, tokens, token_budget, request_budget):
+        used_tokens, used_requests = self.usage.get(key, [0, 0])
+        if token_budget and used_tokens + tokens > token_budget:
+            raise BudgetExceeded(f'Исчерпан дневной лимит токенов ({token_budget}) для {key or "всех организаций"}')
+        if request_budget and used_requests + 1 > request_budget:
+            raise BudgetExceeded(f'Исчерпан дневной лимит запросов ({request_budget}) для {key or "всех организаций"}')
+
+    def reserve(self, org_id, tokens, settings):
+        with self.lock:
+            self.check(None, tokens, settings['global_daily_token_budget'], settings['global_daily_request_budget'])
+            if org_id is not None:
+                self.check(org_id, tokens, settings['daily_token_budget'], settings['daily_request_budget'])
+            for key in budget_keys(org_id):
+                counters = self.usage.setdefault(key, [0, 0])
+                counters[0] += tokens
+                counters[1] += 1
+
+    def settle(self, org_id, reserved, actual, count_request=True):
+        # заменяем оценку фактическим расходом (или снимаем резерв при ошибке вызова)
+        with self.lock:
+            for key in budget_keys(org_id):
+                counters = self.usage.setdefault(key, [0, 0])
+                counters[0] += actual - reserved
+                if not count_request:
+                    counters[1] -= 1
+
+budget = UsageBudget()
+# общий лимит одновременных вызовов: asyncio.Semaphore в цикле событий бота выдает слоты по очереди
+# и обработчикам сообщений, и отчетам из потоков планировщика
+call_slots = None
+call_slots_loop = None
+
+def bind_event_loop():
+    global call_slots, call_slots_loop
+    call_slots_loop = asyncio.get_running_loop()
+    call_slots = asyncio.Semaphore(get_llm_settings()['max_concurrency'])
+
+def get_call_slots():
+    if call_slots is None or call_slots_loop is not asyncio.get_running_loop():
+        bind_event_loop()
+    return call_slots
+
+@contextlib.contextmanager
+def sync_call_slot():
+    # вызывается из потока планировщика; вне процесса бота (запуск analyze_points из консоли) лимит не нужен
+    if call_slots is None or call_slots_loop.is_closed():
+        yield
+        return
+    asyncio.run_coroutine_threadsafe(call_slots.acquire(), call_slots_loop).result()
+    try:
+        yield
+    finally:
+        call_slots_loop.call_soon_threadsafe(call_slots.release)
+
+def prepare_call(org_id, messages, max_tokens, text_length, json_output, kwargs):
+    settings = get_llm_settings(org_id)
+    model = select_model(settings, text_length)
+    if json_output and settings['json_mode']:
+        # JSON mode поддерживают не все модели, поэтому он включается в конфиге
+        kwargs['response_format'] = {'type': 'json_object'}
+    reserved = estimate_tokens(messages, max_tokens)
+    budget.reserve(org_id, reserved, settings)
+    return model, reserved
+
+def record_usage(org_id, model, purpose, reserved, completion):
+    usage = completion.get('usage') or {}
+    total_tokens = usage.get('total_tokens', reserved)
+    budget.settle(org_id, reserved, total_tokens)
+    session = SessionLocal()
+    try:
+        session.add(LLMUsage(
+            organization_id=org_id,
+            model=model,
+            purpose=purpose,
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            total_tokens=total_tokens
+        ))
+        session.commit()
+    except Exception as e:
+        logger.error(f'Ошибка записи расхода токенов: {e}')
+    finally:
+        session.close()
+    return completion['choices'][0]['message']['content']
+
+async def achat_completion(org_id, messages, purpose, max_tokens, temperature, text_length=None, json_output=False, **kwargs):
+    if budget.needs_roll():
+        await asyncio.to_thread(budget.roll_day)
+    model, reserved = prepare_call(org_id, messages, max_tokens, text_length, json_output, kwargs)
+    try:
+        async with get_call_slots():
+            completion = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs
+            )
+    except Exception:
+        budget.settle(org_id, reserved, 0, count_request=False)
+        raise
+    return record_usage(org_id, model, purpose, reserved, completion)
+
+def chat_completion(org_id, messages, purpose, max_tokens, temperature, text_length=None, json_output=False, **kwargs):
+    budget.roll_day()
+    model, reserved = prepare_call(org_id, messages, max_tokens, text_length, json_output, kwargs)
+    try:
+        with sync_call_slot():
+            completion = openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs
+            )
+    except Exception:
+        budget.settle(org_id, reserved, 0, count_request=False)
+        raise
+    return record_usage(org_id, model, purpose, reserved, completion)
@@ -0,0 +1,110 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# ответ модели при извлечении поинтов: {"positive": ["..."], "negative": ["..."]}
+POINTS_SCHEMA_KEYS = ('positive', 'negative')
+# ответ модели для отчета: {"positive": [...], "negative": [...], "main": [...]},
+# элемент секции: {"aspect": "...", "count": 1, "comment": "..."}
+ASPECTS_SCHEMA_KEYS = ('positive', 'negative', 'main')
+
+FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL | re.IGNORECASE)
+LIST_ITEM_RE = re.compile(r'^\s*(?:\d+\s*[.)]|[-*•—–])\s*(.+?)\s*$')
+NEGATIVE_HEADING_RE = re.compile(r'^\s*\**\s*минусы\s*\**\s*:?', re.IGNORECASE | re.MULTILINE)
+POSITIVE_HEADING_RE = re.compile(r'^\s*\**\s*плюсы\s*\**\s*:?', re.IGNORECASE | re.MULTILINE)
+
+json_decoder = json.JSONDecoder()
+
+def extract_json(text):
+    # сначала быстрый путь для чистого JSON, затем блок в ```...``` и первый объект {...} в тексте
+    if not text:
+        return None
+    candidates = [text.strip()]
+    candidates.extend(match.strip() for match in FENCE_RE.findall(text))
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    # raw_decode останавливается на конце объекта, поэтому текст после него (в том числе со скобками) не мешает
+    start = text.find('{')
+    while start != -1:
+        try:
+            data, _ = json_decoder.raw_decode(text, start)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            return data
+        start = text.find('{', start + 1)
+    return None
+
+def normalize_points(items):
+    if isinstance(items, str):
+        items = [items]
+    if not isinstance(items, list):
+        return []
+    points = []
+    for item in items:
+        if isinstance(item, dict):
+            item = item.get('point') or item.get('text') or item.get('aspect')
+        if not isinstance(item, str):
+            continue
+        point = item.strip()
+        if point:
+            points.append(point)
+    return points
+
+def parse_points_text(text):
+    # запасной разбор текстового ответа вида "Плюсы: 1. ... Минусы: 1. ..." с любой нумерацией
+    heading = NEGATIVE_HEADING_RE.search(text)
+    if heading:
+        positives, negatives = text[:heading.start()], text[heading.end():]
+    else:
+        positives, negatives = text, ''
+    positives = POSITIVE_HEADING_RE.sub('', positives, count=1)
+
+    def list_items(section):
+        points = []
+        for line in section.splitlines():
+            match = LIST_ITEM_RE.match(line)
+            if match:
+                points.append(match.group(1).strip('*').strip())
+        return [point for point in points if point]
+
+    return list_items(positives), list_items(negatives)
+
+def parse_points_response(text):
+    data = extract_json(text)
+    if data is not None and any(key in data for key in POINTS_SCHEMA_KEYS):
+        return normalize_points(data.get('positive')), normalize_points(data.get('negative'))
+    logger.warning('Ответ GPT не в формате JSON, используется текстовый разбор.')
+    return parse_points_text(text or '')
+
+def normalize_aspects(items):
+    if not isinstance(items, list):
+        return []
+    aspects = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('aspect'):
+            continue
+        try:
+            count = int(item.get('count') or 0)
+        except (TypeError, ValueError):
+            count = 0
+        aspects.append({
+            'aspect': str(item['aspect']).strip(),
+            'count': count,
+            'comment': str(item.get('comment') or '').strip(),
+        })
+    return sorted(aspects, key=lambda x: x['count'], reverse=True)
+
+def parse_aspects_response(text):
+    data = extract_json(text)
+    if data is None:
+        logger.error('Не удалось извлечь JSON из ответа GPT-4.')
+        return [], [], []
+    return tuple(normalize_aspects(data.get(key)) for key in ASPECTS_SCHEMA_KEYS)
@@ -4,10 +4,14 @@ from sqlalchemy.orm import sessionmaker
 from database import engine
 from models import Base, Organization, Email, OrganizationMessage
 from handlers import create_router
+from middlewares import UserSerializationMiddleware, LifecycleMiddleware
+from lifecycle import lifecycle
+import llm_gateway
 from aiogram import Dispatcher
 from aiogram.client.bot import Bot, DefaultBotProperties
 import sys
 from scheduler import start_scheduler
+from migrations import run_migrations
 
 def load_config(config_path='config.yaml'):
     import yaml
@@ -17,6 +21,7 @@ def load_config(config_path='config.yaml'):
 def setup_organization():
     config = load_config()
     Base.metadata.create_all(bind=engine)
+    run_migrations()
     Session = sessionmaker(bind=engine)
     session = Session()
 
@@ -98,6 +103,8 @@ async def main():
     logger = logging.getLogger(__name__)
 
     setup_organization()
+    lifecycle.install_signal_handlers(asyncio.get_running_loop())
+    llm_gateway.bind_event_loop()
     scheduler = start_scheduler()
 
     Session = sessionmaker(bind=engine)
@@ -105,21 +112,63 @@ async def main():
     orgs = session.query(Organization).all()
     session.close()
 
+    config = load_config()
+    pipeline_config = config.get('pipeline', {})
+    # один экземпляр на все боты, чтобы сообщения пользователя не обрабатывались параллельно в разных ботах
+    serialization_middleware = UserSerializationMiddleware(
+        coalesce_window=pipeline_config.get('coalesce_window', 0)
+    )
+
+    lifecycle_middleware = LifecycleMiddleware(lifecycle)
+
     tasks = []
+    dispatchers = []
+    bots = []
     for org in orgs:
         bot = Bot(
             token=org.telegram_bot_token, 
             default=DefaultBotProperties(parse_mode="HTML")
         )
         dp = Dispatcher()
+        dp.message.outer_middleware(lifecycle_middleware)
+        dp.message.outer_middleware(serialization_middleware)
         dp.include_router(create_router())
+        dispatchers.append(dp)
+        bots.append(bot)
         
-        tasks.append(dp.start_polling(bot, stop_signals=None, org_id=org.id))
+        # сигналы обрабатывает lifecycle, иначе aiogram переопределит обработчики и остановит только свой поллинг;
+        # сессию бота закрываем сами после drain, чтобы обработчики успели отправить ответы
+        tasks.append(asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False, org_id=org.id)))
 
-    if tasks:
-        await asyncio.gather(*tasks)
-    else:
+    if not tasks:
         logger.info("Нет организаций для запуска ботов.")
+        return
+
+    # ждем сигнала остановки или падения поллинга любого из ботов
+    stop_waiter = asyncio.create_task(lifecycle.wait_for_stop())
+    await asyncio.wait([stop_waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    failed = [task for task in tasks if task.done() and not task.cancelled() and task.exception()]
+    for task in failed:
+        logger.error(f"Поллинг бота завершился с ошибкой: {task.exception()!r}")
+    lifecycle.request_stop()
+    await stop_waiter
+
+    # прекращаем получать обновления и запускать задачи планировщика,
+    # затем ждем обработки уже полученных сообщений и начатых рассылок
+    for dp in dispatchers:
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            pass
+    if scheduler:
+        scheduler.shutdown(wait=False)
+    await lifecycle.drain(config.get('lifecycle', {}).get('drain_timeout', 25))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for bot in bots:
+        await bot.session.close()
+    logger.info("Бот остановлен.")
+    if failed:
+        raise failed[0].exception()
 
 if __name__ == "__main__":
     if sys.platform.startswith('win'):
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+class UserSerializationMiddleware(BaseMiddleware):
+    # обрабатывает сообщения одного пользователя строго по очереди поступления,
+    # а тексты, пришедшие в пределах coalesce_window секунд, склеивает в один ответ
+    def __init__(self, coalesce_window=0.0):
+        self.coalesce_window = coalesce_window
+        self.locks = {}
+        self.waiters = {}
+        self.pending = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or not isinstance(event, Message):
+            return await handler(event, data)
+        key = user.id
+        bot = data.get('bot')
+        bot_id = bot.id if bot else None
+
+        entry = None
+        if self.coalesce_window > 0 and event.text and not event.text.startswith('/'):
+            pending = self.pending.get(key)
+            # склеиваем только с еще не начатым ответом, пришедшим в тот же бот
+            if pending is not None and pending['bot_id'] == bot_id:
+                pending['texts'].append(event.text)
+                return None
+            entry = self.pending[key] = {
+                'bot_id': bot_id,
+                'texts': [event.text],
+                'deadline': asyncio.get_running_loop().time() + self.coalesce_window,
+            }
+        else:
+            # команды и прочие обновления закрывают буфер: следующие тексты встанут в очередь после них
+            self.pending.pop(key, None)
+
+        # asyncio.Lock пропускает ожидающих в порядке вызова acquire, это и задает очередь пользователя
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                if entry is not None:
+                    delay = entry['deadline'] - asyncio.get_running_loop().time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if self.pending.get(key) is entry:
+                        del self.pending[key]
+                    if len(entry['texts']) > 1:
+                        logger.info(f'Объединено {len(entry["texts"])} сообщений пользователя {key} в один ответ.')
+                        event = event.model_copy(update={'text': '\n'.join(entry['texts'])})
+                return await handler(event, data)
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+                del self.locks[key]
+
+class LifecycleMiddleware(BaseMiddleware):
+    # регистрирует обработку обновления, чтобы при остановке дождаться ее завершения
+    def __init__(self, lifecycle):
+        self.lifecycle = lifecycle
+
+    async def __call__(self, handler, event, data):
+        async with self.lifecycle.in_flight():
+            return await handler(event, data)
@@ -0,0 +1,79 @@
+import logging
+from sqlalchemy import inspect, text
+from database import engine
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 5000
+
+# колонки, добавленные в существующие таблицы после первого релиза
+ADDED_COLUMNS = {
+    'responses': [
+        ('organization_id', 'INTEGER REFERENCES organizations(id)'),
+        ('extraction_pending', 'BOOLEAN DEFAULT FALSE'),
+        ('extraction_attempts', 'INTEGER DEFAULT 0'),
+        ('extraction_attempted_at', 'TIMESTAMP'),
+    ],
+    'positive_points': [
+        ('organization_id', 'INTEGER REFERENCES organizations(id)'),
+    ],
+    'negative_points': [
+        ('organization_id', 'INTEGER REFERENCES organizations(id)'),
+    ],
+}
+
+def add_missing_columns():
+    # create_all не изменяет существующие таблицы, поэтому новые колонки добавляем вручную
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as connection:
+        for table_name, added_columns in ADDED_COLUMNS.items():
+            if table_name not in existing_tables:
+                continue
+            columns = [column['name'] for column in inspector.get_columns(table_name)]
+            for column_name, column_type in added_columns:
+                if column_name not in columns:
+                    connection.execute(text(
+                        f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'
+                    ))
+                    logger.info(f'Добавлена колонка {column_name} в таблицу {table_name}.')
+
+def backfill_batches(statement, table_name, batch_size):
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            updated = connection.execute(text(statement), {'batch_size': batch_size}).rowcount
+        if not updated:
+            break
+        total += updated
+    if total:
+        logger.info(f'Заполнено organization_id в {table_name}: {total} строк.')
+
+def backfill_organization_id(batch_size=BACKFILL_BATCH_SIZE):
+    # для старых ответов другого источника нет: берем текущую организацию сотрудника
+    backfill_batches(
+        "UPDATE responses SET organization_id = "
+        "(SELECT employees.organization_id FROM employees WHERE employees.id = responses.employee_id) "
+        "WHERE id IN (SELECT responses.id FROM responses JOIN employees ON employees.id = responses.employee_id "
+        "WHERE responses.organization_id IS NULL AND employees.organization_id IS NOT NULL LIMIT :batch_size)",
+        'responses',
+        batch_size
+    )
+    for table_name in ('positive_points', 'negative_points'):
+        backfill_batches(
+            f"UPDATE {table_name} SET organization_id = "
+            f"(SELECT responses.organization_id FROM responses WHERE responses.id = {table_name}.response_id) "
+            f"WHERE id IN (SELECT {table_name}.id FROM {table_name} JOIN responses ON responses.id = {table_name}.response_id "
+            f"WHERE {table_name}.organization_id IS NULL AND responses.organization_id IS NOT NULL LIMIT :batch_size)",
+            table_name,
+            batch_size
+        )
+
+def run_migrations():
+    add_missing_columns()
+    # индексы из models создаются, если их еще нет
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    backfill_organization_id()
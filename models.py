@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, Boolean
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
@@ -48,13 +48,21 @@ class Response(Base):
     __tablename__ = 'responses'
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, ForeignKey('employees.id'))
+    organization_id = Column(Integer, ForeignKey('organizations.id'))
     response_text = Column(String)
     question = Column(String)  
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    extraction_pending = Column(Boolean, default=False, index=True)
+    extraction_attempts = Column(Integer, default=0)
+    extraction_attempted_at = Column(DateTime)
     employee = relationship("Employee", back_populates="responses")
     positive_points = relationship("PositivePoint", back_populates="response", cascade="all, delete-orphan")
     negative_points = relationship("NegativePoint", back_populates="response", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index('ix_responses_organization_id_timestamp', 'organization_id', 'timestamp'),
+    )
+
 class BotMessage(Base):
     __tablename__ = 'bot_messages'
     id = Column(Integer, primary_key=True, index=True)
@@ -67,18 +75,28 @@ class PositivePoint(Base):
     __tablename__ = 'positive_points'
     id = Column(Integer, primary_key=True, index=True)
     response_id = Column(Integer, ForeignKey('responses.id'))
+    organization_id = Column(Integer, ForeignKey('organizations.id'))
     point_text = Column(String)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)  
     response = relationship("Response", back_populates="positive_points")
 
+    __table_args__ = (
+        Index('ix_positive_points_organization_id_timestamp', 'organization_id', 'timestamp', 'point_text'),
+    )
+
 class NegativePoint(Base):
     __tablename__ = 'negative_points'
     id = Column(Integer, primary_key=True, index=True)
     response_id = Column(Integer, ForeignKey('responses.id'))
+    organization_id = Column(Integer, ForeignKey('organizations.id'))
     point_text = Column(String)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)  
     response = relationship("Response", back_populates="negative_points")
 
+    __table_args__ = (
+        Index('ix_negative_points_organization_id_timestamp', 'organization_id', 'timestamp', 'point_text'),
+    )
+
 class OrganizationMessage(Base):
     __tablename__ = 'organization_messages'
     id = Column(Integer, primary_key=True, index=True)
@@ -86,3 +104,23 @@ class OrganizationMessage(Base):
     message_text = Column(String, nullable=False)
     order = Column(Integer, nullable=False)
     organization = relationship("Organization", back_populates="messages")
+
+class LLMUsage(Base):
+    __tablename__ = 'llm_usage'
+    id = Column(Integer, primary_key=True, index=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'))
+    model = Column(String, nullable=False)
+    purpose = Column(String)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class PendingSurvey(Base):
+    __tablename__ = 'pending_surveys'
+    id = Column(Integer, primary_key=True, index=True)
+    organization_id = Column(Integer, ForeignKey('organizations.id'), nullable=False, index=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
+    message_text = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    employee = relationship("Employee")
@@ -0,0 +1,43 @@
+import os
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# шаблоны компилируются один раз при импорте, html экранируется автоматически
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(['html']),
+    trim_blocks=True,
+    lstrip_blocks=True,
+    auto_reload=False,
+)
+html_template = environment.get_template('report_email.html')
+text_template = environment.get_template('report_email.txt')
+
+def build_report_context(org_name, top_positive_data, top_negative_data, main_aspects_data):
+    return {
+        'org_name': org_name,
+        'sections': [
+            {
+                'title': 'Основные позитивные аспекты:',
+                'rows': top_positive_data,
+                'empty_message': 'Нет данных по позитивным аспектам.',
+            },
+            {
+                'title': 'Основные негативные аспекты:',
+                'rows': top_negative_data,
+                'empty_message': 'Нет данных по негативным аспектам.',
+            },
+            {
+                'title': 'Главные аспекты деятельности компании:',
+                'rows': main_aspects_data,
+                'empty_message': 'Нет данных по главным аспектам.',
+            },
+        ],
+    }
+
+def render_report_html(context):
+    return html_template.render(context)
+
+def render_report_text(context):
+    return text_template.render(context)
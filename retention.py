@@ -0,0 +1,266 @@
+import argparse
+import datetime
+import logging
+import os
+import yaml
+import pandas as pd
+from sqlalchemy import func, select, text
+from database import SessionLocal, engine
+from models import Organization, Employee, Response, PositivePoint, NegativePoint, BotMessage
+
+logger = logging.getLogger(__name__)
+
+def load_config(config_path='config.yaml'):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+config = load_config()
+
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_BATCH_SIZE = 1000
+
+def get_retention_settings(org_name=None):
+    # глобальные настройки из секции retention, переопределяются в секции организации
+    settings = {
+        'days': DEFAULT_RETENTION_DAYS,
+        'archive_dir': 'archive',
+        'format': 'parquet',
+        'batch_size': DEFAULT_BATCH_SIZE,
+    }
+    settings.update(config.get('retention') or {})
+    for org_data in config.get('organizations', []):
+        if org_data.get('name') == org_name:
+            settings.update(org_data.get('retention') or {})
+    return settings
+
+def write_archive(df, org_id, table_name, batch_stamp, settings):
+    org_dir = os.path.join(settings['archive_dir'], f'org_{org_id}')
+    os.makedirs(org_dir, exist_ok=True)
+    if settings['format'] == 'parquet':
+        path = os.path.join(org_dir, f'{table_name}_{batch_stamp}.parquet')
+        df.to_parquet(path, compression='zstd', index=False)
+    else:
+        path = os.path.join(org_dir, f'{table_name}_{batch_stamp}.csv.gz')
+        df.to_csv(path, compression='gzip', index=False)
+    return path
+
+def read_archive(org_id, table_name, archive_dir=None):
+    # для аудита: собирает все архивные файлы таблицы организации в один DataFrame
+    archive_dir = archive_dir or get_retention_settings()['archive_dir']
+    org_dir = os.path.join(archive_dir, f'org_{org_id}')
+    if not os.path.isdir(org_dir):
+        return pd.DataFrame()
+    frames = []
+    for file_name in sorted(os.listdir(org_dir)):
+        if not file_name.startswith(f'{table_name}_'):
+            continue
+        path = os.path.join(org_dir, file_name)
+        if file_name.endswith('.parquet'):
+            frames.append(pd.read_parquet(path))
+        elif file_name.endswith('.csv.gz'):
+            frames.append(pd.read_csv(path, compression='gzip'))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def archive_responses_batch(session, org_id, cutoff, settings):
+    response_ids = [
+        row.id for row in (
+            session.query(Response.id)
+            .filter(
+                Response.organization_id == org_id,
+                Response.timestamp < cutoff
+            )
+            .order_by(Response.id)
+            .limit(settings['batch_size'])
+            .all()
+        )
+    ]
+    if not response_ids:
+        return 0
+
+    responses = pd.read_sql(
+        session.query(Response).filter(Response.id.in_(response_ids)).statement,
+        session.connection()
+    )
+    positive_points = pd.read_sql(
+        session.query(PositivePoint).filter(PositivePoint.response_id.in_(response_ids)).statement,
+        session.connection()
+    )
+    negative_points = pd.read_sql(
+        session.query(NegativePoint).filter(NegativePoint.response_id.in_(response_ids)).statement,
+        session.connection()
+    )
+
+    batch_stamp = f'{datetime.datetime.utcnow():%Y%m%d%H%M%S}_{response_ids[0]}'
+    write_archive(responses, org_id, 'responses', batch_stamp, settings)
+    write_archive(positive_points, org_id, 'positive_points', batch_stamp, settings)
+    write_archive(negative_points, org_id, 'negative_points', batch_stamp, settings)
+
+    # удаляем только после успешной записи архива
+    session.query(PositivePoint).filter(PositivePoint.response_id.in_(response_ids)).delete(synchronize_session=False)
+    session.query(NegativePoint).filter(NegativePoint.response_id.in_(response_ids)).delete(synchronize_session=False)
+    session.query(Response).filter(Response.id.in_(response_ids)).delete(synchronize_session=False)
+    session.commit()
+    return len(response_ids)
+
+def archive_bot_messages_batch(session, org_id, cutoff, settings):
+    # последнее сообщение бота определяет текущий вопрос сотрудника, его не трогаем
+    latest_ids = select(func.max(BotMessage.id)).group_by(BotMessage.employee_id)
+    message_ids = [
+        row.id for row in (
+            session.query(BotMessage.id)
+            .join(BotMessage.employee)
+            .filter(
+                BotMessage.timestamp < cutoff,
+                Employee.organization_id == org_id,
+                BotMessage.id.notin_(latest_ids)
+            )
+            .order_by(BotMessage.id)
+            .limit(settings['batch_size'])
+            .all()
+        )
+    ]
+    if not message_ids:
+        return 0
+
+    bot_messages = pd.read_sql(
+        session.query(BotMessage).filter(BotMessage.id.in_(message_ids)).statement,
+        session.connection()
+    )
+    batch_stamp = f'{datetime.datetime.utcnow():%Y%m%d%H%M%S}_{message_ids[0]}'
+    write_archive(bot_messages, org_id, 'bot_messages', batch_stamp, settings)
+
+    session.query(BotMessage).filter(BotMessage.id.in_(message_ids)).delete(synchronize_session=False)
+    session.commit()
+    return len(message_ids)
+
+def archive_organization(org_id):
+    session = SessionLocal()
+    try:
+        organization = session.query(Organization).filter(Organization.id == org_id).first()
+        if not organization:
+            logger.error(f'Организация {org_id} не найдена')
+            return
+        settings = get_retention_settings(organization.name)
+        if not settings['days']:
+            logger.info(f'Хранение без ограничения срока для организации {organization.name}.')
+            return
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings['days'])
+
+        archived_responses = 0
+        while True:
+            archived = archive_responses_batch(session, org_id, cutoff, settings)
+            if not archived:
+                break
+            archived_responses += archived
+
+        archived_messages = 0
+        while True:
+            archived = archive_bot_messages_batch(session, org_id, cutoff, settings)
+            if not archived:
+                break
+            archived_messages += archived
+
+        logger.info(
+            f'Архивировано для организации {organization.name}: '
+            f'ответов {archived_responses}, сообщений бота {archived_messages}.'
+        )
+    except Exception as e:
+        session.rollback()
+        logger.error(f'Ошибка архивации для org {org_id}: {e}')
+    finally:
+        session.close()
+
+def is_responses_partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    result = connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = 'responses'"
+    ))
+    return result.first() is not None
+
+def month_start(date, shift=0):
+    month_index = date.year * 12 + date.month - 1 + shift
+    return datetime.datetime(month_index // 12, month_index % 12 + 1, 1)
+
+def ensure_response_partitions(months_ahead=2):
+    # только для Postgres, если таблица responses уже секционирована по timestamp
+    if not (config.get('database') or {}).get('partition_responses'):
+        return
+    with engine.begin() as connection:
+        if not is_responses_partitioned(connection):
+            logger.info('Таблица responses не секционирована, создание секций пропущено.')
+            return
+        now = datetime.datetime.utcnow()
+        for shift in range(months_ahead + 1):
+            start = month_start(now, shift)
+            end = month_start(now, shift + 1)
+            partition_name = f'responses_y{start:%Y}m{start:%m}'
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF responses "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+    logger.info('Секции таблицы responses проверены.')
+
+def drop_expired_partitions():
+    # секции, целиком вышедшие за самый длинный срок хранения и уже пустые после архивации
+    if not (config.get('database') or {}).get('partition_responses'):
+        return
+    retention_days = [get_retention_settings()['days']]
+    for org_data in config.get('organizations', []):
+        retention_days.append(get_retention_settings(org_data.get('name'))['days'])
+    if not all(retention_days):
+        return
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max(retention_days))
+    with engine.begin() as connection:
+        if not is_responses_partitioned(connection):
+            return
+        partitions = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'responses'"
+        )).scalars().all()
+        for partition_name in partitions:
+            try:
+                start = datetime.datetime.strptime(partition_name, 'responses_y%Ym%m')
+            except ValueError:
+                continue
+            if month_start(start, 1) > cutoff:
+                continue
+            has_rows = connection.execute(text(f'SELECT 1 FROM {partition_name} LIMIT 1')).first()
+            if has_rows:
+                continue
+            connection.execute(text(f'DROP TABLE {partition_name}'))
+            logger.info(f'Удалена пустая секция {partition_name}.')
+
+def run_retention():
+    logger.info('Запуск задачи архивации устаревших данных.')
+    try:
+        ensure_response_partitions()
+    except Exception as e:
+        logger.error(f'Ошибка при создании секций responses: {e}')
+    session = SessionLocal()
+    try:
+        org_ids = [org.id for org in session.query(Organization).all()]
+    finally:
+        session.close()
+    for org_id in org_ids:
+        archive_organization(org_id)
+    try:
+        drop_expired_partitions()
+    except Exception as e:
+        logger.error(f'Ошибка при удалении устаревших секций responses: {e}')
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Архивация устаревших ответов, поинтов и сообщений бота.')
+    parser.add_argument('--org_id', type=int, help='Идентификатор организации (по умолчанию: все организации).')
+    args = parser.parse_args()
+    if args.org_id:
+        archive_organization(args.org_id)
+    else:
+        run_retention()
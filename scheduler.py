@@ -1,12 +1,18 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from database import SessionLocal
-from models import Employee, Organization, BotMessage, OrganizationMessage
+from models import Employee, Organization, BotMessage, OrganizationMessage, Response, PendingSurvey
 from aiogram import Bot
 import yaml
 import logging
 import asyncio
 from analyze_points import analyze_points
+from retention import run_retention
+from handlers import extract_points, record_extraction_failure
+from llm_gateway import BudgetExceeded
+from lifecycle import lifecycle
+from sqlalchemy import func
+import datetime
 
 logger = logging.getLogger(__name__)
 
@@ -20,29 +26,109 @@ async def send_survey(org_id):
     logger.info(f"Запуск задачи send_survey для организации ID {org_id}.")
     session = SessionLocal()
     try:
-        organization = session.query(Organization).filter(Organization.id==org_id).first()
-        if not organization:
-            logger.error(f"Организация {org_id} не найдена")
-            return
-        first_msg = session.query(OrganizationMessage).filter(OrganizationMessage.organization_id==org_id).order_by(OrganizationMessage.order).first()
-        if not first_msg:
-            logger.info("Нет сообщений для отправки")
-            return
-
-        employees = session.query(Employee).filter(Employee.organization_id==org_id).all()
-        bot = Bot(token=organization.telegram_bot_token)
-        for emp in employees:
-            session.query(BotMessage).filter(BotMessage.employee_id==emp.id).delete()
-            session.commit()
-            await bot.send_message(chat_id=emp.telegram_id, text=first_msg.message_text)
-            bm = BotMessage(employee_id=emp.id, message_text=first_msg.message_text)
-            session.add(bm)
+        async with lifecycle.in_flight():
+            organization = session.query(Organization).filter(Organization.id==org_id).first()
+            if not organization:
+                logger.error(f"Организация {org_id} не найдена")
+                return
+            first_msg = session.query(OrganizationMessage).filter(OrganizationMessage.organization_id==org_id).order_by(OrganizationMessage.order).first()
+            if not first_msg:
+                logger.info("Нет сообщений для отправки")
+                return
+
+            # сохраняем список получателей до рассылки, чтобы после перезапуска продолжить с места остановки
+            session.query(PendingSurvey).filter(PendingSurvey.organization_id==org_id).delete()
+            employees = session.query(Employee).filter(Employee.organization_id==org_id).all()
+            for emp in employees:
+                session.add(PendingSurvey(organization_id=org_id, employee_id=emp.id, message_text=first_msg.message_text))
             session.commit()
+
+            await deliver_pending_surveys(session, organization)
     except Exception as e:
         logger.error(f"Ошибка при отправке опроса для org {org_id}: {e}")
     finally:
         session.close()
 
+async def deliver_pending_surveys(session, organization):
+    pending = session.query(PendingSurvey).filter(PendingSurvey.organization_id==organization.id).order_by(PendingSurvey.id).all()
+    bot = Bot(token=organization.telegram_bot_token)
+    try:
+        for item in pending:
+            if lifecycle.stopping:
+                remaining = session.query(PendingSurvey).filter(PendingSurvey.organization_id==organization.id).count()
+                logger.info(f"Рассылка для {organization.name} приостановлена, осталось получателей: {remaining}.")
+                return
+            emp = item.employee
+            try:
+                session.query(BotMessage).filter(BotMessage.employee_id==emp.id).delete()
+                session.commit()
+                await bot.send_message(chat_id=emp.telegram_id, text=item.message_text)
+                bm = BotMessage(employee_id=emp.id, message_text=item.message_text)
+                session.add(bm)
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Не удалось отправить опрос сотруднику {emp.name}: {e}")
+            session.delete(item)
+            session.commit()
+    finally:
+        await bot.session.close()
+
+async def resume_pending_surveys():
+    session = SessionLocal()
+    try:
+        async with lifecycle.in_flight():
+            org_ids = [row[0] for row in session.query(PendingSurvey.organization_id).distinct().all()]
+            for org_id in org_ids:
+                organization = session.query(Organization).filter(Organization.id==org_id).first()
+                if not organization:
+                    continue
+                logger.info(f"Продолжение прерванной рассылки для организации {organization.name}.")
+                await deliver_pending_surveys(session, organization)
+    except Exception as e:
+        logger.error(f"Ошибка при продолжении рассылки: {e}")
+    finally:
+        session.close()
+
+async def process_deferred_extractions(batch_size=50):
+    # ответы, для которых поинты не извлечены из-за лимита или ошибки OpenAI;
+    # свежие пропускаем, чтобы не пересекаться с еще работающим message_handler
+    settled_before = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    session = SessionLocal()
+    try:
+        async with lifecycle.in_flight():
+            await extract_deferred_batch(session, settled_before, batch_size)
+    finally:
+        session.close()
+
+async def extract_deferred_batch(session, settled_before, batch_size):
+    # ответы, исчерпавшие max_extraction_attempts, остаются в extraction_pending и больше не запрашиваются;
+    # сначала берем те, что давно не пробовали, чтобы один сбойный ответ не загораживал остальные
+    max_attempts = config.get('llm', {}).get('max_extraction_attempts', 5)
+    responses = (
+        session.query(Response)
+        .filter(
+            Response.extraction_pending == True,
+            Response.timestamp < settled_before,
+            func.coalesce(Response.extraction_attempts, 0) < max_attempts
+        )
+        .order_by(Response.extraction_attempted_at.asc().nulls_first(), Response.id)
+        .limit(batch_size)
+        .all()
+    )
+    for response in responses:
+        if lifecycle.stopping:
+            break
+        try:
+            await extract_points(session, response)
+        except BudgetExceeded as e:
+            logger.info(f"Отложенное извлечение поинтов остановлено: {e}")
+            break
+        except Exception as e:
+            logger.error(f"Ошибка отложенного извлечения поинтов для ответа {response.id}: {e}")
+            record_extraction_failure(session, response)
+            if response.extraction_attempts >= max_attempts:
+                logger.warning(f"Ответ {response.id} исключен из отложенного извлечения после {max_attempts} попыток.")
+
 def run_analyze_points(org_id, days):
     logger.info(f"Запуск analyze_points для org_id {org_id}")
     try:
@@ -73,6 +159,15 @@ def start_scheduler():
 
             scheduler.add_job(run_analyze_points, report_trigger, args=[org.id, days])
 
+        retention_schedule = config.get('retention', {}).get('schedule', {})
+        retention_trigger = CronTrigger(hour=retention_schedule.get('hour', 3), minute=retention_schedule.get('minute', 0))
+        scheduler.add_job(run_retention, retention_trigger)
+
+        deferred_interval = config.get('llm', {}).get('deferred_interval_minutes', 15)
+        # сразу после запуска доделываем работу, прерванную при предыдущей остановке
+        scheduler.add_job(process_deferred_extractions, 'interval', minutes=deferred_interval, next_run_time=datetime.datetime.now())
+        scheduler.add_job(resume_pending_surveys)
+
         scheduler.start()
         return scheduler
     except Exception as e: